@@ -0,0 +1,72 @@
+import { parentPort, workerData } from "worker_threads";
+import porcupine from "@picovoice/porcupine-node";
+
+// Runs one connection's Porcupine handle off the main event loop.
+// The main thread posts raw PCM chunks (Uint8Array, ownership transferred)
+// followed by a final null on disconnect; detections are posted back as
+// { type: "wake", keywordIndex }.
+const { accessKey, keywordPaths, sensitivities, frameLength, maxQueuedChunks, state } = workerData;
+const FRAME_BYTES = frameLength * Int16Array.BYTES_PER_ELEMENT;
+
+// Indices into the shared state array, mirrored in server.js.
+const PENDING = 0;
+const PAUSED = 1;
+
+const porcupineHandle = new porcupine.Porcupine(accessKey, keywordPaths, sensitivities);
+
+// Fixed-size scratch buffer allocated once and reused for the worker's
+// lifetime; large chunks are fed through it in pieces. Tracked in bytes so
+// an odd trailing byte (half a sample split across chunks) is carried over
+// rather than dropped, which would shift every later sample by one byte.
+const sampleBuffer = new Int16Array(frameLength * 4);
+const sampleBytes = new Uint8Array(sampleBuffer.buffer);
+// The buffer never moves, so the per-frame views can be built up front.
+const frameViews = Array.from({ length: sampleBuffer.length / frameLength }, (_, i) =>
+  sampleBuffer.subarray(i * frameLength, (i + 1) * frameLength)
+);
+let byteCount = 0;
+
+// Hot path classification: process() runs a small fixed-size network in
+// Porcupine's native library, which already uses SIMD internally and has no
+// batch API, and a 32 ms frame costs it a small fraction of a millisecond.
+// Per-frame time is dominated by what surrounds it: message handling,
+// copies and allocations in JS. Optimize byte handling and the connection
+// lifecycle; there is nothing to gain in vectorizing calls into process().
+parentPort.on("message", (chunk) => {
+  if (chunk === null) {
+    porcupineHandle.delete();
+    parentPort.close();
+    return;
+  }
+
+  let chunkOffset = 0;
+  while (chunkOffset < chunk.length) {
+    // Copy bytes rather than viewing the chunk as Int16, which would need
+    // an even byteOffset and an even length.
+    const copied = Math.min(chunk.length - chunkOffset, sampleBytes.length - byteCount);
+    sampleBytes.set(chunk.subarray(chunkOffset, chunkOffset + copied), byteCount);
+    chunkOffset += copied;
+    byteCount += copied;
+
+    // Hand Porcupine views into the buffer; only the tail is moved afterwards.
+    const frameCount = Math.floor(byteCount / FRAME_BYTES);
+    for (let i = 0; i < frameCount; i++) {
+      const keywordIndex = porcupineHandle.process(frameViews[i]);
+
+      if (keywordIndex >= 0) {
+        parentPort.postMessage({ type: "wake", keywordIndex });
+      }
+    }
+
+    const consumed = frameCount * FRAME_BYTES;
+    sampleBytes.copyWithin(0, consumed, byteCount);
+    byteCount -= consumed;
+  }
+
+  // Let the main thread resume reading the socket once the queue has
+  // drained to half its cap.
+  const pending = Atomics.sub(state, PENDING, 1) - 1;
+  if (pending <= maxQueuedChunks / 2 && Atomics.compareExchange(state, PAUSED, 1, 0) === 1) {
+    parentPort.postMessage({ type: "resume" });
+  }
+});
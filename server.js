@@ -4,6 +4,7 @@ import WebSocket from "ws";
 import path from "path";
 import fs from "fs";
 import { fileURLToPath } from "url";
+import { Worker } from "worker_threads";
 import porcupine from "@picovoice/porcupine-node";
 
 const __dirname = path.dirname(fileURLToPath(import.meta.url));
@@ -29,58 +30,203 @@ const FRAME_LENGTH = porcupine.FRAME_LENGTH || 512;
 console.log(`Porcupine sampleRate=${SAMPLE_RATE}, frameLength=${FRAME_LENGTH}`);
 console.log("Keyword paths:", KEYWORD_PATHS);
 
-let porcupineHandle = new porcupine.Porcupine(ACCESS_KEY, KEYWORD_PATHS, sensitivities);
+// Porcupine keeps audio state between frames, so every connection gets its
+// own handle, and each handle lives in its own worker thread so native
+// processing never blocks the event loop serving the other sockets.
+// Chunks queued for a worker are capped; past the cap the socket is paused
+// until the worker has drained half of them.
+const MAX_QUEUED_CHUNKS = 16;
+
+// Each session holds a native Porcupine handle, so cap how many sessions
+// exist and drop connections that stop sending audio (e.g. half-open
+// sockets that never deliver a close). The Map keeps insertion order and
+// sessions are re-inserted on activity, so the first entry is the least
+// recently used. The cap counts sessions only: the handles alive at once
+// are at most MAX_SESSIONS plus POOL_SIZE pre-warmed workers (see below),
+// plus workers of just-closed or evicted sessions still draining their
+// queued audio before they exit.
+const MAX_SESSIONS = Number(process.env.MAX_SESSIONS) || 32;
+const IDLE_TIMEOUT_MS = (Number(process.env.IDLE_TIMEOUT_S) || 300) * 1000;
+const sessions = new Map();
+
+// Only live sessions are refreshed; one that was evicted or whose worker
+// has exited is not brought back.
+function touchSession(ws, session) {
+  if (!sessions.delete(ws)) return;
+  session.lastAccess = performance.now();
+  sessions.set(ws, session);
+}
+
+function evictSession(ws, reason) {
+  console.log(`Evicting ${reason} session.`);
+  sessions.delete(ws);
+  ws.terminate();
+}
+
+setInterval(() => {
+  const cutoff = performance.now() - IDLE_TIMEOUT_MS;
+  for (const [ws, session] of sessions) {
+    if (session.lastAccess >= cutoff) break;
+    evictSession(ws, "idle");
+  }
+}, 30_000).unref();
+
+// Indices into the shared state array, mirrored in detector-worker.js.
+const PENDING = 0;
+const PAUSED = 1;
+
+function createDetectorWorker() {
+  const state = new Int32Array(new SharedArrayBuffer(2 * Int32Array.BYTES_PER_ELEMENT));
+  const worker = new Worker(new URL("./detector-worker.js", import.meta.url), {
+    workerData: {
+      accessKey: ACCESS_KEY,
+      keywordPaths: KEYWORD_PATHS,
+      sensitivities,
+      frameLength: FRAME_LENGTH,
+      maxQueuedChunks: MAX_QUEUED_CHUNKS,
+      state,
+    },
+  });
+  worker.on("error", (err) => console.error("Detector worker failed:", err.message));
+  return { worker, state };
+}
+
+// Loading the Porcupine model is the slow part of starting a session, so a
+// few detector workers are kept pre-warmed. Porcupine has no reset, so a
+// worker is never reused after its session ends; instead the pool is
+// topped up in the background each time one is checked out.
+const POOL_SIZE = Number(process.env.DETECTOR_POOL_SIZE) || 2;
+const pool = [];
+
+function refillPool() {
+  while (pool.length < POOL_SIZE) {
+    const detector = createDetectorWorker();
+    pool.push(detector);
+    detector.worker.once("exit", () => {
+      const i = pool.indexOf(detector);
+      if (i >= 0) pool.splice(i, 1);
+    });
+  }
+}
+
+function checkoutDetector() {
+  const detector = pool.shift() ?? createDetectorWorker();
+  setImmediate(refillPool);
+  return detector;
+}
+
+// Server events are fixed payloads, so encode them once at startup. They
+// are sent as text frames ({ binary: false }) so browsers still receive a
+// string they can JSON.parse.
+function encodeEvent(obj) {
+  return Buffer.from(JSON.stringify(obj));
+}
+
+const WAKE_MESSAGES = Object.freeze(KEYWORD_PATHS.map((_, keywordIndex) =>
+  encodeEvent({ event: "wake", keywordIndex })
+));
+const INIT_ERROR_MESSAGE = encodeEvent({ event: "error", message: "Failed to initialize wake word engine" });
+
+// Fail fast on a bad access key or keyword path.
+new porcupine.Porcupine(ACCESS_KEY, KEYWORD_PATHS, sensitivities).delete();
 console.log("✅ Porcupine initialized");
+refillPool();
 
 // ===== WS (NO TLS) =====
 const server = http.createServer(app);
-const wss = new WebSocket.Server({ server, path: "/ws-audio" });
+// Raw PCM does not compress well, so skip permessage-deflate on the audio path.
+// ws buffers each message in full before emitting it (up to 100 MiB by
+// default); clients send ~4 KB batches, so cap messages at 64 KiB (~2 s of
+// audio) to bound per-connection memory.
+const MAX_MESSAGE_BYTES = 64 * 1024;
+const wss = new WebSocket.Server({
+  server,
+  path: "/ws-audio",
+  perMessageDeflate: false,
+  maxPayload: MAX_MESSAGE_BYTES,
+});
 
 wss.on("connection", (ws, req) => {
   console.log("Client connected:", req.socket.remoteAddress);
-  let sampleBuffer = new Int16Array(0);
-
-  ws.on("message", (msg) => {
-    if (typeof msg === "string") {
-      try {
-        const obj = JSON.parse(msg);
-        if (obj.type === "info") console.log("Client info:", obj);
-      } catch {
-        console.log("Received text:", msg);
-      }
-      return;
-    }
 
-    let buf = Buffer.from(msg);
-    if (buf.length % 2 !== 0) buf = buf.slice(0, buf.length - 1);
+  if (sessions.size >= MAX_SESSIONS) {
+    evictSession(sessions.keys().next().value, "capacity");
+  }
+
+  const { worker, state } = checkoutDetector();
+  const session = { worker, lastAccess: performance.now() };
+  sessions.set(ws, session);
 
-    const incoming = new Int16Array(buf.buffer, buf.byteOffset, buf.length / 2);
-    const combined = new Int16Array(sampleBuffer.length + incoming.length);
-    combined.set(sampleBuffer, 0);
-    combined.set(incoming, sampleBuffer.length);
-    sampleBuffer = combined;
+  worker.on("message", (msg) => {
+    if (msg.type === "wake") {
+      if (ws.readyState === WebSocket.OPEN) ws.send(WAKE_MESSAGES[msg.keywordIndex], { binary: false });
+      console.log("Wake word detected!");
+    } else if (msg.type === "resume") {
+      ws.resume();
+    }
+  });
 
-    while (sampleBuffer.length >= FRAME_LENGTH) {
-      const frame = sampleBuffer.slice(0, FRAME_LENGTH);
-      const keywordIndex = porcupineHandle.process(frame);
+  worker.on("error", () => {
+    if (ws.readyState === WebSocket.OPEN) {
+      ws.send(INIT_ERROR_MESSAGE, { binary: false });
+      ws.close();
+    }
+  });
 
-      if (keywordIndex >= 0) {
-        ws.send(JSON.stringify({ event: "wake", keywordIndex }));
-        console.log("Wake word detected!");
+  worker.on("exit", () => sessions.delete(ws));
+
+  ws.on("message", (msg, isBinary) => {
+    // ws 8 delivers text frames as Buffers too; only isBinary tells them apart.
+    if (!isBinary) {
+      const text = msg.toString();
+      // Control messages are JSON objects; don't pay for a parse (and a
+      // thrown SyntaxError) on anything that can't be one.
+      let obj;
+      if (text[0] === "{") {
+        try {
+          obj = JSON.parse(text);
+        } catch {}
       }
+      if (!obj) console.log("Received text:", text);
+      else if (obj.type === "info") console.log("Client info:", obj);
+      return;
+    }
 
-      sampleBuffer = sampleBuffer.slice(FRAME_LENGTH);
+    if (msg.length === 0) return;
+
+    // msg may share its ArrayBuffer with other socket data, so copy it into
+    // a buffer of its own and transfer that to the worker.
+    touchSession(ws, session);
+    const chunk = new Uint8Array(msg);
+    if (Atomics.add(state, PENDING, 1) + 1 >= MAX_QUEUED_CHUNKS) {
+      Atomics.store(state, PAUSED, 1);
+      ws.pause();
     }
+    worker.postMessage(chunk, [chunk.buffer]);
   });
 
-  ws.on("close", () => console.log("Client disconnected."));
+  ws.on("close", () => {
+    worker.postMessage(null);
+    console.log("Client disconnected.");
+  });
 });
 
-process.on("SIGINT", () => {
+// Cleanup runs once at shutdown: each worker is asked to delete its
+// Porcupine handle (after finishing queued audio) and we exit when all
+// of them have stopped.
+function shutdown() {
   console.log("Shutting down…");
-  porcupineHandle.delete();
-  process.exit(0);
-});
+  server.close();
+  const workers = [...sessions.values(), ...pool].map(({ worker }) => worker);
+  const exits = workers.map((worker) => new Promise((resolve) => {
+    worker.once("exit", resolve);
+    worker.postMessage(null);
+  }));
+  Promise.all(exits).then(() => process.exit(0));
+}
+
+process.once("SIGINT", shutdown);
+process.once("SIGTERM", shutdown);
 
 server.listen(PORT, () => {
   console.log(`🌐 Listening on ws://localhost:${PORT}/ws-audio`);